@@ -42,7 +42,69 @@ SUPPORT, UPDATES, ENHANCEMENTS, OR MODIFICATIONS.
 __author__ = "Claudio Jolowicz <jolowicz@gmail.com>"
 __date__ = "1 April 2007"
 __version__ = "0.2.2"
-__all__ = ['logged', 'autolog']
+__all__ = ['logged', 'autolog', 'traced', 'governor', 'queued',
+           'collapsed', 'rotating', 'indexed', 'trace', 'columns', 'remote',
+           'collector']
+
+import array, atexit, collections, errno, inspect, os, socket, stat, \
+       struct, sys, thread, threading, time, Queue
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Log sinks which need to know the logged callable provide a method
+#
+#     writerecord(text, name, time=None, thread=None)
+#
+# which the decorator calls instead of write. The time and thread
+# default to those of the caller. The sink's writerecord method (or
+# None) is cached for the current log object.
+_sink = (None, None)
+
+def _writerecord(log):
+    """Return the writerecord method of `log', or None."""
+    global _sink
+    _sink = log, None # in case getattr is logged itself
+    _sink = log, getattr(log, 'writerecord', None)
+    return _sink[1]
+
+def _exception(exc_type, exc_value):
+    """Format an exception for a [raise] message.
+
+    This is called while the exception propagates, so it must not
+    raise: if the message cannot be converted to str, use the repr of
+    the exception, or only the name of its type.
+    """
+    name = getattr(exc_type, '__name__', None) or repr(exc_type)
+    try:
+        text = exc_value is not None and str(exc_value) or ''
+    except Exception:
+        try:
+            return repr(exc_value)
+        except Exception:
+            return name
+    if not text:
+        return name
+    return '%s: %s' % (name, text)
+
+class _lazy(object):
+    """Attribute of the decorator classes computed on first access."""
+    def __init__(self, func):
+        self._func = func
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self._func.__name__] = self._func(obj)
+        return value
 
 class _logged(object):
     """Logging decorator implementation.
@@ -52,6 +114,9 @@ class _logged(object):
     """
     import sys
     log = sys.stderr
+    governor = None
+    targeted = False
+    coroutines = False
 
     def __init__(self, func):
         """Grab the function and get a printable representation."""
@@ -62,15 +127,89 @@ class _logged(object):
         else:
             object.__setattr__(self, '_repr', repr(func))
 
+    # The following attributes are only needed by some log sinks and
+    # by the governor, so they are computed on first use.
+
+    @_lazy
+    def _name(self):
+        """Name of the callable (qualified by the class in __get__)."""
+        func = self._func
+        return getattr(func, '__name__', None) or \
+               getattr(func, '__class__', type(func)).__name__
+
+    @_lazy
+    def _key(self):
+        """Key of the callable, as distinct callables may share a name."""
+        return getattr(self._func, 'func_code', None) or self._func
+
+    @_lazy
+    def _coroutine(self):
+        """True if the callable is a generator function (or method)."""
+        code = getattr(self._func, 'func_code', None)
+        return code is not None and bool(code.co_flags & inspect.CO_GENERATOR)
+
     def __call__(self, *args, **kwargs):
         """Invoke the decorated function, logging its entry and exit."""
+        if self.targeted and (getattr(_scope, 'current', None) is None or
+                              self._repr is None):
+            return self._func(*args, **kwargs)
+
+        governor = self.governor
+        if governor is not None:
+            if not governor.admit(self._key, self._name):
+                return self._func(*args, **kwargs)
+            start = time.time()
+
         args_repr = ', '.join(
             [repr(arg) for arg in args] +
             ['%s=%r' % (name, value) for name, value in kwargs.iteritems()])
 
-        self.log.write('[call] %s(%s)\n' % (self._repr, args_repr))
-        retval = self._func(*args, **kwargs)
-        self.log.write('[exit] %s(%s) = %r\n' % (self._repr, args_repr, retval))
+        log, writerecord = _sink
+        if log is not self.log:
+            log = self.log
+            writerecord = _writerecord(log)
+
+        if self.coroutines and self._coroutine:
+            generator = self._func(*args, **kwargs)
+            text = '[start] %s(%s)\n' % (self._repr, args_repr)
+            if writerecord is None:
+                log.write(text)
+            else:
+                writerecord(text, self._name)
+            if governor is not None:
+                governor.charge(self._key, time.time() - start)
+            return _coroutine(self, generator, args_repr)
+
+        if writerecord is None:
+            log.write('[call] %s(%s)\n' % (self._repr, args_repr))
+        else:
+            writerecord('[call] %s(%s)\n' % (self._repr, args_repr), self._name)
+        if governor is not None:
+            overhead = time.time() - start
+        try:
+            retval = self._func(*args, **kwargs)
+        except:
+            exc_type, exc_value, tb = sys.exc_info()
+            if governor is not None:
+                start = time.time()
+            text = '[raise] %s(%s) %s\n' % (
+                self._repr, args_repr, _exception(exc_type, exc_value))
+            if writerecord is None:
+                log.write(text)
+            else:
+                writerecord(text, self._name)
+            if governor is not None:
+                governor.charge(self._key, overhead + time.time() - start)
+            raise exc_type, exc_value, tb
+        if governor is not None:
+            start = time.time()
+        if writerecord is None:
+            log.write('[exit] %s(%s) = %r\n' % (self._repr, args_repr, retval))
+        else:
+            writerecord('[exit] %s(%s) = %r\n' % (self._repr, args_repr, retval),
+                        self._name)
+        if governor is not None:
+            governor.charge(self._key, overhead + time.time() - start)
 
         return retval
 
@@ -101,6 +240,11 @@ class logged(_logged):
         [call] frobnicate('god')
         [exit] frobnicate('god') = 'MEN'
 
+    If the function raises an exception, a [raise] message is logged
+    instead of the [exit] message, and the exception propagates:
+
+        [raise] frobnicate(None) TypeError: 'NoneType' object is not iterable
+
     To decorate a class or a lambda expression, use the alternative
     syntax:
 
@@ -133,6 +277,16 @@ class logged(_logged):
     decorated functions are declared. An example is given at the end
     of the source file.
 
+    To limit the time spent logging, assign a governor object to the
+    `governor' class attribute:
+
+        _logged.governor = governor(fraction=0.01)
+
+    To log only calls made within a traced scope, such as the handling
+    of a selected request, set the `targeted' class attribute:
+
+        _logged.targeted = True
+
     The decorator transparently wraps the callable in the sense that
     it has no effect on the return value and side effects except for
     writing to the log, and any attribute access is delegated to the
@@ -178,13 +332,34 @@ class logged(_logged):
 
     While it may seem desirable to treat `yield' statements and
     `return' statements alike in terms of logging, doing so is
-    problematic: Nothing differentiates a function containing a yield
-    statement from a function returning a generator object.  Thus,
-    full generator support implies modifying a function's return
-    value, which violates the transparency of the function
+    problematic: Full generator support implies modifying a function's
+    return value, which violates the transparency of the function
     wrapper. Besides, this is not easily done, since the generator's
     next method is a read-only attribute.
 
+    If you use generators as coroutines, the time at which they
+    finish matters more than transparency. Set the `coroutines' class
+    attribute to have the decorator return a proxy for the generator
+    of a generator function:
+
+        _logged.coroutines = True
+
+    The proxy supports next, send, throw, and close. Instead of the
+    [call] and [exit] messages at instantiation, the decorator logs a
+    [start] message. The proxy logs a [finish] message when the
+    generator finishes, a [fail] message when it raises an exception,
+    and a [cancel] message when it is closed before finishing, with
+    the time elapsed since the start:
+
+        [start] consumer('jobs')
+        [finish] consumer('jobs') after 0.001234s
+        [start] consumer('mail')
+        [fail] consumer('mail') IOError: timed out after 0.002345s
+
+    A generator which is dropped without finishing logs no message.
+    To keep slow log files from holding up a coroutine scheduler, log
+    to a queued sink.
+
     Subclassing the logged class.
 
     When deriving a class from the decorator, a few things should be
@@ -253,11 +428,18 @@ class logged(_logged):
         """
         def __init__(self, outer, instance, owner):
             """Bind the method and get a printable representation."""
-            # Get a method object and delegate to super.
+            # Get a method object.
             func = outer._func
             if hasattr(func, '__get__') and \
                    getattr(func, '__name__', None) != '__new__':
                 func = func.__get__(instance, owner)
+
+            # Outside a traced scope, calls go straight through (see
+            # _repr below), so skip the printable representation.
+            if outer.targeted and getattr(_scope, 'current', None) is None:
+                object.__setattr__(self, '_func', func)
+                return
+
             super(logged.__get__, self).__init__(func)
 
             # Add instance or owner to the printable representation.
@@ -266,6 +448,27 @@ class logged(_logged):
             else: # owner is not None
                 object.__setattr__(self, '_repr', '%r.%s' % (owner, self._repr))
 
+            object.__setattr__(self, '_outer', outer)
+            if owner is None:
+                owner = instance.__class__
+            object.__setattr__(self, '_owner', owner)
+
+        # Set by __init__, unless the method object was retrieved outside
+        # a traced scope; calls through such objects are not logged.
+        _repr = None
+
+        @_lazy
+        def _name(self):
+            return '%s.%s' % (self._owner.__name__, self._outer._name)
+
+        @_lazy
+        def _key(self):
+            return self._outer._key, self._owner
+
+        @_lazy
+        def _coroutine(self):
+            return self._outer._coroutine
+
 def skip(func):
     func._skip_autolog = True
     return func
@@ -335,6 +538,1423 @@ class autolog(type):
                 dict[key] = property(**_dict)
         return type.__new__(cls, name, bases, dict)
 
+# The traced scope of the current thread.
+_scope = threading.local()
+
+class traced(object):
+    """Scope in which logged calls are traced.
+
+    If the `targeted' class attribute of the decorator is set, calls
+    are only logged while a scope is active. Use a with statement (in
+    Python 2.5, import with_statement from __future__) to trace the
+    handling of a selected request:
+
+        _logged.targeted = True
+
+        def handle(request):
+            with traced(request.headers.get('X-Trace-Id')):
+                ...
+
+    The scope is an arbitrary object, for example a request or job
+    identifier. A scope of None does not trace, so the example above
+    only logs requests carrying the header. Outside a traced scope,
+    the decorator calls through after a single lookup. Methods are
+    only bound, without computing their printable representation;
+    calls through a method object retrieved outside a scope are not
+    logged, even if they happen inside one.
+
+    The scope is local to the thread which entered it. To carry it
+    over to a thread you start, wrap the thread's target:
+
+        threading.Thread(target=traced.propagate(work)).start()
+    """
+    def __init__(self, scope):
+        self.scope = scope
+
+    def __enter__(self):
+        # Save the enclosing scope per thread, as the same instance may
+        # be entered by several threads.
+        try:
+            saved = _scope.saved
+        except AttributeError:
+            saved = _scope.saved = []
+        saved.append(getattr(_scope, 'current', None))
+        _scope.current = self.scope
+        return self
+
+    def __exit__(self, *exc_info):
+        _scope.current = _scope.saved.pop()
+
+    @staticmethod
+    def current():
+        """Return the scope of the current thread, or None."""
+        return getattr(_scope, 'current', None)
+
+    @classmethod
+    def propagate(cls, func):
+        """Return a function which calls `func' in the current scope."""
+        scope = cls.current()
+        def propagated(*args, **kwargs):
+            context = cls(scope)
+            context.__enter__()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                context.__exit__(None, None, None)
+        return propagated
+
+class _coroutine(object):
+    """Generator proxy which logs when the generator finishes.
+
+    This is an internal class used by the decorator if the `coroutines'
+    class attribute is set.
+    """
+    def __init__(self, logged, generator, args_repr):
+        self._logged = logged
+        self._generator = generator
+        self._args_repr = args_repr
+        self._start = time.time()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self._resume(self._generator.next)
+
+    def send(self, value):
+        return self._resume(self._generator.send, value)
+
+    def throw(self, *args):
+        return self._resume(self._generator.throw, *args)
+
+    def close(self):
+        if self._generator.gi_frame is not None:
+            self._generator.close()
+            self._log('cancel')
+
+    def _resume(self, method, *args):
+        if self._generator.gi_frame is None:
+            return method(*args) # finished, and logged already
+        try:
+            return method(*args)
+        except StopIteration:
+            self._log('finish')
+            raise
+        except:
+            exc_type, exc_value, tb = sys.exc_info()
+            self._log('fail', ' ' + _exception(exc_type, exc_value))
+            raise exc_type, exc_value, tb
+
+    def _log(self, kind, detail=''):
+        logged = self._logged
+        text = '[%s] %s(%s)%s after %.6fs\n' % (
+            kind, logged._repr, self._args_repr, detail,
+            time.time() - self._start)
+        writerecord = getattr(logged.log, 'writerecord', None)
+        if writerecord is None:
+            logged.log.write(text)
+        else:
+            writerecord(text, logged._name)
+
+class governor(object):
+    """Budget for the overhead of logging.
+
+    To keep the time spent logging below 1% of the wall time, use:
+
+        _logged.governor = governor(fraction=0.01)
+
+    Alternatively, the budget can be given in nanoseconds per call:
+
+        _logged.governor = governor(percall=2000)
+
+    The decorator measures the time it spends formatting and writing
+    log messages, and charges it to the logged callable. Every
+    `interval' seconds, the governor compares the overhead against
+    the budget, and moves callables between three levels:
+
+        FULL      every call is logged
+        SAMPLED   one in `rate' calls is logged
+        COUNTED   calls are only counted
+
+    If the budget is exceeded, callables step down one level, starting
+    with the most expensive one. A fraction of wall time is a budget
+    for all callables together, so only as many callables step down as
+    needed to get back under budget. A budget per call applies to each
+    callable separately. When the projected overhead of logging a
+    callable at the next higher level is within half the budget, the
+    callable steps back up one level.
+
+    Use stats() to inspect the overhead and the current levels.
+
+    Known limitations.
+
+    Counters are not synchronized between threads, so they may be
+    slightly off. The overhead includes the time spent writing to the
+    log file, but not the time spent in the logged callable.
+    Methods are accounted separately for every class through which
+    they are called.
+    """
+    FULL, SAMPLED, COUNTED = 0, 1, 2
+
+    class _usage(object):
+        """Per-callable counters, for the current interval and in total."""
+        __slots__ = ('name', 'level', 'calls', 'logged', 'overhead', 'cost',
+                     'total_calls', 'total_logged', 'total_overhead')
+
+        def __init__(self, name):
+            self.name = name
+            self.level = self.calls = self.logged = 0
+            self.total_calls = self.total_logged = 0
+            self.overhead = self.total_overhead = self.cost = 0.0
+
+    def __init__(self, fraction=None, percall=None, interval=1.0, rate=100):
+        if (fraction is None) == (percall is None):
+            raise ValueError('expected either fraction or percall')
+        self.fraction = fraction
+        self.percall = percall
+        self.interval = interval
+        self.rate = rate
+        self._usages = {}
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._deadline = self._start + interval
+
+    def admit(self, key, name):
+        """Count a call, and return True if it should be logged.
+
+        The `key' identifies the callable; `name' is used in stats().
+        """
+        usage = self._usages.get(key)
+        if usage is None:
+            usage = self._usages.setdefault(key, self._usage(name))
+        usage.calls += 1
+        if usage.level == self.FULL:
+            return True
+        if usage.calls % self.rate:
+            return False
+        if usage.level == self.SAMPLED:
+            return True
+        # Without logged calls, charge() never runs; adjust here.
+        now = time.time()
+        if now >= self._deadline:
+            self._adjust(now)
+        return False
+
+    def charge(self, key, overhead):
+        """Charge `overhead' seconds spent logging a call to `key'."""
+        usage = self._usages[key]
+        usage.logged += 1
+        usage.overhead += overhead
+        now = time.time()
+        if now >= self._deadline:
+            self._adjust(now)
+
+    def stats(self):
+        """Return a list of overhead statistics per callable.
+
+        For every callable, the statistics give its name, its current
+        level, the total number of calls, the number of logged calls,
+        the overhead of logging in seconds, and the overhead per logged
+        call. Callables sharing a name have separate entries. The list
+        is sorted by overhead, most expensive first.
+        """
+        stats = []
+        for usage in self._usages.values():
+            stats.append({
+                'name': usage.name,
+                'level': usage.level,
+                'calls': usage.total_calls + usage.calls,
+                'logged': usage.total_logged + usage.logged,
+                'overhead': usage.total_overhead + usage.overhead,
+                'cost': usage.cost})
+        stats.sort(key=lambda entry: -entry['overhead'])
+        return stats
+
+    def _share(self, level):
+        """Return the share of calls which are logged at `level'."""
+        return (1.0, 1.0 / self.rate, 0.0)[level]
+
+    def _adjust(self, now):
+        """Move callables between levels, and start a new interval."""
+        if not self._lock.acquire(False):
+            return # another thread is adjusting
+        try:
+            usages = self._usages.values()
+            for usage in usages:
+                if usage.logged:
+                    usage.cost = usage.overhead / usage.logged
+
+            if self.percall is not None:
+                budget = self.percall * 1e-9
+                for usage in usages:
+                    if usage.cost * self._share(usage.level) > budget:
+                        if usage.level < self.COUNTED:
+                            usage.level += 1
+                    elif usage.level > self.FULL and \
+                             usage.cost * self._share(usage.level - 1) <= budget / 2:
+                        usage.level -= 1
+            else:
+                budget = self.fraction * (now - self._start)
+                total = sum([usage.overhead for usage in usages])
+                if total > budget:
+                    usages.sort(key=lambda usage: -usage.overhead)
+                    for usage in usages:
+                        if total <= budget:
+                            break
+                        if usage.level < self.COUNTED:
+                            usage.level += 1
+                            total -= usage.overhead - usage.cost * usage.calls * \
+                                     self._share(usage.level)
+                elif total <= budget / 2:
+                    def increase(usage):
+                        return usage.cost * usage.calls * (
+                            self._share(usage.level - 1) - self._share(usage.level))
+                    usages = [usage for usage in usages if usage.level > self.FULL]
+                    usages.sort(key=increase)
+                    for usage in usages:
+                        if total + increase(usage) > budget / 2:
+                            break
+                        total += increase(usage)
+                        usage.level -= 1
+
+            for usage in self._usages.values():
+                usage.total_calls += usage.calls
+                usage.total_logged += usage.logged
+                usage.total_overhead += usage.overhead
+                usage.calls = usage.logged = 0
+                usage.overhead = 0.0
+            self._start = now
+            self._deadline = now + self.interval
+        finally:
+            self._lock.release()
+
+class collapsed(object):
+    """Log sink to collapse repeated calls.
+
+    Polling and retry loops through logged callables produce long runs
+    of identical log messages. To collapse them, wrap the log file:
+
+        _logged.log = collapsed(sys.stderr)
+
+    A call is repeated if the same thread logs the same [call] and
+    [exit] messages as for its previous call, i.e. the callable,
+    arguments, and return value are the same. Only the first call of
+    a run is logged; the remaining calls are summarized:
+
+        [call] poll()
+        [exit] poll() = None
+        ... repeated 41 times
+
+    Any other message logged by the thread ends the run. To keep the
+    log current, a summary is also written after `window' repeats, and
+    after `interval' seconds have passed since the first repeat.
+
+    The [call] message is held back until the matching [exit] message
+    arrives, so the sink can tell whether the call is repeated. A
+    background thread writes out held-back messages and pending
+    summaries once they are `interval' seconds old, so a call which
+    hangs still shows up in the log. Remaining messages are written
+    when the interpreter exits, or when close() is called.
+
+    Known limitations.
+
+    Only calls without logged calls nested inside them are collapsed,
+    because a nested message ends the run. For example, three calls
+    to outer() which each call inner() produce all twelve messages.
+    """
+    class _run(object):
+        """Per-thread state: held-back call, last call, repeat count."""
+        __slots__ = ('ident', 'call', 'name', 'time', 'held', 'last',
+                     'count', 'since', 'until')
+
+        def __init__(self, ident):
+            self.ident = ident
+            self.call = self.last = None
+            self.name = '-'
+            self.time = self.held = self.since = self.until = 0.0
+            self.count = 0
+
+    def __init__(self, stream, window=1000, interval=1.0):
+        self.stream = stream
+        self.window = window
+        self.interval = interval
+        self._runs = {}
+        self._lock = threading.Lock()
+        self._writerecord = getattr(stream, 'writerecord', None)
+        self._stopped = threading.Event()
+        self._timer = threading.Thread(target=self._tick)
+        self._timer.setDaemon(True)
+        self._timer.start()
+        atexit.register(self._exit)
+
+    def write(self, text):
+        self.writerecord(text, '-')
+
+    def writerecord(self, text, name, t=None, ident=None):
+        """Write a log message of the callable `name'.
+
+        If the stream has a writerecord method, the time and thread of
+        each message are passed on, including for held-back messages.
+        """
+        now = time.time()
+        if t is None:
+            t = now
+        self._lock.acquire()
+        try:
+            if ident is None:
+                ident = thread.get_ident()
+            run = self._runs.get(ident)
+            if run is None:
+                run = self._runs[ident] = self._run(ident)
+            for line in text.splitlines(True):
+                self._line(run, line, name, t, now)
+        finally:
+            self._lock.release()
+
+    def flush(self):
+        """Write out held-back messages and pending summaries."""
+        self._lock.acquire()
+        try:
+            for run in self._runs.values():
+                self._break(run)
+            self._runs.clear()
+            self.stream.flush()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """Stop the background thread and write out all messages."""
+        self._stopped.set()
+        self._timer.join()
+        self.flush()
+
+    def _exit(self):
+        if not self._stopped.isSet():
+            self.close()
+
+    def _tick(self):
+        while not self._stopped.isSet():
+            self._stopped.wait(self.interval)
+            self._lock.acquire()
+            try:
+                self._expire(time.time())
+            finally:
+                self._lock.release()
+
+    def _line(self, run, line, name, t, now):
+        if line.startswith('[call] '):
+            if run.call is not None:
+                self._break(run)
+            run.call, run.name, run.time, run.held = line, name, t, now
+        elif run.call is not None and line.startswith('[exit] ') and \
+                 line.startswith(run.call[7:].rstrip('\n') + ' = ', 7):
+            pair, run.call = (run.call, line), None
+            if pair == run.last:
+                run.count += 1
+                run.until = t
+                if run.count == 1:
+                    run.since = now
+                elif run.count >= self.window:
+                    self._summarize(run)
+            else:
+                self._summarize(run)
+                self._emit(pair[0], run.name, run.time, run.ident)
+                self._emit(pair[1], run.name, t, run.ident)
+                run.last = pair
+        else:
+            self._break(run)
+            self._emit(line, name, t, run.ident)
+
+    def _emit(self, line, name, t, ident):
+        if self._writerecord is None:
+            self.stream.write(line)
+        else:
+            self._writerecord(line, name, t, ident)
+
+    def _break(self, run):
+        """End the current run and release any held-back call."""
+        self._summarize(run)
+        if run.call is not None:
+            self._emit(run.call, run.name, run.time, run.ident)
+            run.call = None
+        run.last = None
+
+    def _summarize(self, run):
+        if run.count:
+            self._emit('... repeated %d times\n' % run.count, run.name,
+                       run.until, run.ident)
+            run.count = 0
+
+    def _expire(self, now):
+        """Write out messages older than `interval' seconds."""
+        limit = now - self.interval
+        for ident, run in self._runs.items():
+            if run.call is not None and run.held <= limit:
+                self._break(run)
+            elif run.count and run.since <= limit:
+                self._summarize(run)
+            if run.call is None and not run.count and run.held <= limit:
+                del self._runs[ident]
+
+class _worker(object):
+    """Log sink base class which writes from a background thread.
+
+    Calls to write() only enqueue the text. A daemon thread collects
+    the queued text into chunks of up to `chunksize' writes and passes
+    each chunk to the _chunk method, which subclasses must override.
+    Enqueued text is written out and the sink closed when the
+    interpreter exits, or when close() is called.
+    """
+    def __init__(self, maxsize=0, chunksize=1024):
+        self.chunksize = chunksize
+        self._queue = Queue.Queue(maxsize)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        atexit.register(self._exit)
+
+    def write(self, text):
+        self._queue.put(text)
+
+    def flush(self):
+        """Wait until all enqueued text has been written."""
+        self._queue.join()
+
+    def close(self):
+        """Write all enqueued text and stop the background thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _exit(self):
+        if not self._closed:
+            self.close()
+
+    def _run(self):
+        queue = self._queue
+        while True:
+            chunk = [queue.get()]
+            try:
+                while chunk[-1] is not None and len(chunk) < self.chunksize:
+                    chunk.append(queue.get_nowait())
+            except Queue.Empty:
+                pass
+            done = chunk[-1] is None
+            if done:
+                chunk.pop()
+            try:
+                try:
+                    self._chunk(chunk)
+                    if done:
+                        self._close()
+                except Exception:
+                    import traceback
+                    traceback.print_exc(file=sys.stderr)
+            finally:
+                for text in chunk:
+                    queue.task_done()
+                if done:
+                    queue.task_done()
+            if done:
+                return
+
+    def _chunk(self, chunk):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+class queued(_worker):
+    """Log sink writing to a file from a background thread.
+
+    To keep callers from waiting for a slow log file, use:
+
+        _logged.log = queued(sys.stderr)
+
+    Calls to write() only enqueue the message. If `maxsize' is given,
+    callers block while that many messages are pending. Pending
+    messages are written out when the interpreter exits, or when
+    close() is called; this does not close the file.
+    """
+    def __init__(self, stream, maxsize=0, chunksize=1024):
+        self.stream = stream
+        super(queued, self).__init__(maxsize, chunksize)
+
+    def _chunk(self, chunk):
+        self.stream.write(''.join(chunk))
+        self.stream.flush()
+
+class rotating(_worker):
+    """Log sink writing to a compressed, rotated file.
+
+    To write the log to a gzip-compressed file, use:
+
+        _logged.log = rotating('trace.log.gz')
+
+    The file is rotated when its compressed size exceeds `maxbytes',
+    or when it is older than `interval' seconds. Rotation renames
+    the file to trace.log.gz.1, trace.log.gz.1 to trace.log.gz.2,
+    and so on, keeping at most `backups' old files. An existing
+    trace.log.gz, such as the log of a previous run, is rotated when
+    the sink is created.
+
+    The `compression' argument selects the file format. Supported
+    values are 'gzip', 'zstd' (if the zstandard package is installed),
+    and None for an uncompressed file.
+
+    Compression, writing, and rotation happen on a background thread;
+    the caller only enqueues the message. Messages are never dropped:
+    those arriving during a rotation go to the new file. If `maxsize'
+    is given, callers block while that many messages are pending.
+    Pending messages are written out and the file closed when the
+    interpreter exits, or when close() is called.
+    """
+    def __init__(self, filename, maxbytes=64 << 20, interval=None,
+                 backups=5, compression='gzip', maxsize=0, chunksize=1024):
+        if compression not in ('gzip', 'zstd', None):
+            raise ValueError('unknown compression: %r' % (compression,))
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError('zstd compression requires zstandard')
+        self.filename = filename
+        self.maxbytes = maxbytes
+        self.interval = interval
+        self.backups = backups
+        self.compression = compression
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            self._shift() # keep the log of a previous run
+        self._open()
+        super(rotating, self).__init__(maxsize, chunksize)
+
+    def _open(self):
+        self._raw = open(self.filename, 'wb')
+        self._opened = time.time()
+        if self.compression == 'gzip':
+            import gzip
+            self._file = gzip.GzipFile(fileobj=self._raw, mode='wb')
+        elif self.compression == 'zstd':
+            self._file = zstandard.ZstdCompressor().stream_writer(self._raw)
+        else:
+            self._file = self._raw
+
+    def _close(self):
+        self._file.close()
+        self._raw.close()
+
+    def _chunk(self, chunk):
+        self._file.write(''.join(chunk))
+        if self._raw.tell() >= self.maxbytes or \
+               (self.interval is not None and
+                time.time() - self._opened >= self.interval):
+            self._rotate()
+
+    def _rotate(self):
+        self._close()
+        self._shift()
+        self._open()
+
+    def _shift(self):
+        name = self.filename
+        if self.backups > 0:
+            if os.path.exists('%s.%d' % (name, self.backups)):
+                os.remove('%s.%d' % (name, self.backups))
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists('%s.%d' % (name, i)):
+                    os.rename('%s.%d' % (name, i), '%s.%d' % (name, i + 1))
+            os.rename(name, name + '.1')
+
+# The index of a trace consists of three files. The index file holds
+# a fixed-width entry for every message: its offset in the trace file,
+# time, thread, callable, and kind. Callables are numbered in order of
+# appearance; the names file holds their names, one per line. Entries
+# are grouped into blocks, and the blocks file holds a line for every
+# complete block, giving its first entry, number of entries, earliest
+# and latest time, and the callables occurring in the block.
+_indexentry = struct.Struct('<QdqIB')
+_kinds = ('-', 'call', 'exit', 'raise', 'start', 'finish', 'cancel', 'fail')
+_kindcodes = {}
+for _code, _kind in enumerate(_kinds):
+    _kindcodes['[%s] ' % _kind] = _code
+del _code, _kind
+
+def _readentries(f, first, last):
+    """Read index entries [first, last) as a flat tuple of fields."""
+    f.seek(first * _indexentry.size)
+    data = f.read((last - first) * _indexentry.size)
+    count = len(data) // _indexentry.size
+    return struct.unpack('<' + _indexentry.format[1:] * count,
+                         data[:count * _indexentry.size])
+
+def _readlines(filename, position):
+    """Return complete lines appended after `position', and the new position."""
+    try:
+        f = open(filename, 'rb')
+    except IOError:
+        return [], position
+    try:
+        f.seek(position)
+        data = f.read()
+    finally:
+        f.close()
+    data = data[:data.rfind('\n') + 1]
+    return data.splitlines(), position + len(data)
+
+class indexed(object):
+    """Log sink writing a trace file with an index.
+
+    To record a trace which can be queried using the trace class, use:
+
+        _logged.log = indexed('trace.log')
+
+    The log messages are appended to trace.log. For every message, an
+    entry is appended to the index file trace.log.idx, holding the
+    offset of the message in the trace file, the time and thread of
+    the call, the kind of message (such as call or exit), and the logged
+    callable. The names of the callables are kept in trace.log.idx.names.
+    Every `blocksize' entries, a summary of the block is appended to
+    trace.log.idx.blocks, so queries can skip blocks which do not
+    contain the callable or time they look for.
+
+    Methods are named after the class through which they were
+    accessed. Messages not written by the decorator have the name `-'.
+    Messages received by a collector keep the time and thread of the
+    original call.
+    """
+    def __init__(self, filename, index=None, blocksize=4096):
+        self.filename = filename
+        self.index = index or filename + '.idx'
+        self.blocksize = blocksize
+        self._file = open(filename, 'ab')
+        self._file.seek(0, 2)
+        self._names = open(self.index + '.names', 'ab')
+        self._blocks = open(self.index + '.blocks', 'ab')
+        self._index = open(self.index, 'ab')
+        self._lock = threading.Lock()
+
+        # Continue an existing index.
+        self._ids = {}
+        for name in _readlines(self.index + '.names', 0)[0]:
+            self._ids[name] = len(self._ids)
+        self._index.seek(0, 2)
+        self._count = self._index.tell() // _indexentry.size
+        self._index.truncate(self._count * _indexentry.size)
+        self._first = 0
+        for line in _readlines(self.index + '.blocks', 0)[0]:
+            first, count = line.split(' ', 2)[:2]
+            self._first = int(first) + int(count)
+        self._start()
+        f = open(self.index, 'rb')
+        try:
+            fields = _readentries(f, self._first, self._count)
+        finally:
+            f.close()
+        for i in xrange(0, len(fields), 5):
+            self._add(fields[i + 1], fields[i + 3])
+
+    def _start(self):
+        self._tmin, self._tmax, self._block = None, None, set()
+
+    def _add(self, t, nid):
+        if self._tmin is None or t < self._tmin:
+            self._tmin = t
+        if self._tmax is None or t > self._tmax:
+            self._tmax = t
+        self._block.add(nid)
+
+    def write(self, text):
+        self.writerecord(text, '-')
+
+    def writerecord(self, text, name, t=None, ident=None):
+        """Write a log message of the callable `name'."""
+        kind = _kindcodes.get(text[:text.find('] ') + 2], 0)
+        if ident is None:
+            ident = thread.get_ident()
+        self._lock.acquire()
+        try:
+            nid = self._ids.get(name)
+            if nid is None:
+                nid = self._ids[name] = len(self._ids)
+                self._names.write(name.replace('\n', ' ') + '\n')
+                self._names.flush()
+            if t is None:
+                t = time.time()
+            offset = self._file.tell()
+            self._file.write(text)
+            self._index.write(_indexentry.pack(offset, t, ident, nid, kind))
+            self._count += 1
+            self._add(t, nid)
+            if self._count - self._first >= self.blocksize:
+                self._blocks.write('%d %d %.6f %.6f %s\n' % (
+                    self._first, self._count - self._first,
+                    self._tmin, self._tmax, ' '.join(map(str, sorted(self._block)))))
+                self._first = self._count
+                self._start()
+        finally:
+            self._lock.release()
+
+    def flush(self):
+        self._lock.acquire()
+        try:
+            self._file.flush()
+            self._index.flush()
+            self._blocks.flush()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            self._file.close()
+            self._index.close()
+            self._blocks.close()
+            self._names.close()
+        finally:
+            self._lock.release()
+
+class trace(object):
+    """Trace recorded by the indexed log sink.
+
+    To find all calls to Torinese.show between two points in time in
+    a given thread, use:
+
+        for t, ident, line in trace('trace.log').query(
+                'Torinese.show', start, end, ident):
+            print line,
+
+    Only the callable names and the block summaries are read into
+    memory. A query reads the index entries of the blocks which may
+    contain matching records, and of the last, incomplete block. The
+    matching messages are read by seeking to their offsets in the
+    trace file.
+
+    The trace may still be written to while it is queried. Each query
+    reads the names and blocks appended since the previous query.
+    Records which have not been flushed to the trace file are skipped.
+
+    The same queries are available from the command line:
+
+        python autolog.py query trace.log --name=Torinese.show
+
+    For statistics over many calls, convert the trace using columns.
+    """
+    def __init__(self, filename, index=None):
+        self.filename = filename
+        self.index = index or filename + '.idx'
+        self.names = []
+        self._ids = {}
+        self._blocks = []
+        self._positions = [0, 0]
+        self.refresh()
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self.index) // _indexentry.size
+        except OSError:
+            return 0
+
+    def refresh(self):
+        """Read names and block summaries appended since the last refresh."""
+        lines, self._positions[0] = _readlines(self.index + '.names',
+                                               self._positions[0])
+        for name in lines:
+            self._ids[name] = len(self.names)
+            self.names.append(name)
+
+        lines, self._positions[1] = _readlines(self.index + '.blocks',
+                                               self._positions[1])
+        for line in lines:
+            fields = line.split()
+            first, count = int(fields[0]), int(fields[1])
+            self._blocks.append((first, first + count,
+                                 float(fields[2]), float(fields[3]),
+                                 frozenset(map(int, fields[4:]))))
+
+    def records(self, name=None, start=None, end=None, ident=None):
+        """Yield (offset, time, thread, kind, name) of matching entries.
+
+        Only index entries are read, not the messages themselves.
+        """
+        self.refresh()
+        nid = None
+        if name is not None:
+            nid = self._ids.get(name)
+            if nid is None:
+                return
+
+        ranges = []
+        for first, last, tmin, tmax, ids in self._blocks:
+            if (start is not None and tmax < start) or \
+                   (end is not None and tmin > end) or \
+                   (nid is not None and nid not in ids):
+                continue
+            ranges.append((first, last))
+        ranges.append((self._blocks and self._blocks[-1][1] or 0, len(self)))
+
+        f = open(self.index, 'rb')
+        try:
+            for first, last in ranges:
+                fields = _readentries(f, first, last)
+                for i in xrange(0, len(fields), 5):
+                    offset, t, thread_, n, kind = fields[i:i + 5]
+                    if (nid is not None and n != nid) or \
+                           (start is not None and t < start) or \
+                           (end is not None and t > end) or \
+                           (ident is not None and thread_ != ident):
+                        continue
+                    if n >= len(self.names):
+                        self.refresh()
+                    yield (offset, t, thread_, _kinds[kind],
+                           n < len(self.names) and self.names[n] or '-')
+        finally:
+            f.close()
+
+    def query(self, name=None, start=None, end=None, ident=None):
+        """Yield (time, thread, message) for the matching records.
+
+        All arguments are optional. Records are matched by callable
+        name, by time (start <= time <= end, in seconds since the
+        epoch), and by thread identifier.
+        """
+        f = open(self.filename, 'rb')
+        try:
+            for offset, t, thread_, kind, _name in self.records(
+                    name, start, end, ident):
+                f.seek(offset)
+                line = f.readline()
+                if not line.endswith('\n'):
+                    break
+                yield t, thread_, line
+        finally:
+            f.close()
+
+def _query(args):
+    """Command-line interface to trace.query."""
+    import optparse
+    parser = optparse.OptionParser(
+        usage='%prog query [options] TRACE',
+        description='Print the records of an indexed trace.')
+    parser.add_option('-n', '--name', help='name of the logged callable')
+    parser.add_option('-s', '--start', type='float', help='start time')
+    parser.add_option('-e', '--end', type='float', help='end time')
+    parser.add_option('-t', '--thread', type='int', help='thread identifier')
+    parser.add_option('-v', '--verbose', action='store_true',
+                      help='prefix records with time and thread')
+    options, args = parser.parse_args(args)
+    if len(args) != 1:
+        parser.error('expected a single trace file')
+
+    for t, ident, line in trace(args[0]).query(
+            options.name, options.start, options.end, options.thread):
+        if options.verbose:
+            line = '%.6f %d %s' % (t, ident, line)
+        sys.stdout.write(line)
+    return 0
+
+# Typecode for 64-bit integers; C long has only 32 bits on some platforms.
+_int64 = array.array('l').itemsize >= 8 and 'l' or 'd'
+
+class columns(object):
+    """Timings of the calls in an indexed trace, stored by column.
+
+    To analyze the calls recorded by an indexed trace, use:
+
+        calls = columns(trace('trace.log'))
+        calls.save('trace.npz')
+        print calls.top(10)
+
+    Every call is stored as one element in each of the following
+    typed arrays:
+
+        callable     index of the callable in the `names' list
+        start_ns     start of the call, in nanoseconds since the epoch
+        duration_ns  duration of the call, or -1 if it did not end
+        thread       thread identifier
+        depth        number of enclosing calls in the same thread
+
+    Times in the trace have microsecond resolution. Calls are matched
+    with their [exit] or [raise] messages by thread and callable name.
+    Calls without such a message, such as calls still running at the
+    end of the trace, have no duration. An [exit] or [raise] message
+    without a matching call is ignored.
+
+    Generators logged as coroutines are stored with the depth at which
+    they were started, but do not count as enclosing later calls. They
+    last until their [finish], [fail], or [cancel] message, which may
+    come from another thread. If coroutines of the same name overlap,
+    they are matched in the order they were started.
+
+    The analysis methods require NumPy. They operate on whole columns
+    at once: percentiles() of the duration per callable, the top()
+    callables by total duration, and call rates() per time interval.
+    Use save() to write the columns to a NumPy .npz file, and load()
+    to read them back.
+    """
+    fields = ('callable', 'start_ns', 'duration_ns', 'thread', 'depth')
+
+    def __init__(self, trace=None):
+        self.names = []
+        self.callable = array.array('i')
+        self.start_ns = array.array(_int64)
+        self.duration_ns = array.array(_int64)
+        self.thread = array.array(_int64)
+        self.depth = array.array('i')
+        if trace is not None:
+            self._convert(trace)
+
+    def __len__(self):
+        return len(self.callable)
+
+    def _convert(self, trace):
+        ids, stacks, started = {}, {}, {}
+        for offset, t, ident, kind, name in trace.records():
+            ns = int(round(t * 1e6)) * 1000
+            stack = stacks.setdefault(ident, [])
+            if kind in ('call', 'start'):
+                if name not in ids:
+                    ids[name] = len(self.names)
+                    self.names.append(name)
+                depth = len(stack)
+                if kind == 'call':
+                    stack.append((len(self.callable), ns, name))
+                else: # coroutines do not enclose later calls
+                    started.setdefault(name, []).append((len(self.callable), ns))
+                self.callable.append(ids[name])
+                self.start_ns.append(ns)
+                self.duration_ns.append(-1)
+                self.thread.append(ident)
+                self.depth.append(depth)
+            elif kind in ('exit', 'raise'):
+                # Unwind enclosed calls which left no message.
+                for i in xrange(len(stack) - 1, -1, -1):
+                    j, start, _name = stack[i]
+                    if _name == name:
+                        self.duration_ns[j] = ns - start
+                        del stack[i:]
+                        break
+            elif kind in ('finish', 'fail', 'cancel'):
+                if started.get(name):
+                    j, start = started[name].pop(0)
+                    self.duration_ns[j] = ns - start
+
+    def arrays(self):
+        """Return a dictionary of the columns as NumPy arrays."""
+        np = _numpy()
+        arrays = {}
+        for field in self.fields:
+            arrays[field] = np.asarray(getattr(self, field)).astype(np.int64)
+        return arrays
+
+    def save(self, filename):
+        """Write the columns and callable names to a .npz file."""
+        np = _numpy()
+        np.savez(filename, names=np.array(self.names), **self.arrays())
+
+    @classmethod
+    def load(cls, filename):
+        """Read columns written by save()."""
+        np = _numpy()
+        data = np.load(filename)
+        self = cls()
+        self.names = [str(name) for name in data['names']]
+        for field in cls.fields:
+            setattr(self, field, data[field])
+        return self
+
+    def _returned(self):
+        """Return callable ids and durations of calls which returned."""
+        np = _numpy()
+        ids = np.asarray(self.callable).astype(np.intp)
+        durations = np.asarray(self.duration_ns).astype(np.int64)
+        returned = durations >= 0
+        return ids[returned], durations[returned]
+
+    def percentiles(self, q=(50, 90, 99)):
+        """Return {name: [percentiles of the duration in ns]}."""
+        np = _numpy()
+        ids, durations = self._returned()
+        order = np.lexsort((durations, ids))
+        durations = durations[order]
+        counts = np.bincount(ids, minlength=len(self.names))
+        starts = np.cumsum(counts) - counts
+        present = np.flatnonzero(counts)
+
+        # Interpolate linearly between the closest ranks.
+        q = np.asarray(q, dtype=float) / 100
+        pos = starts[present, None] + (counts[present, None] - 1) * q
+        lo = np.floor(pos).astype(np.intp)
+        hi = np.ceil(pos).astype(np.intp)
+        values = durations[lo] + (durations[hi] - durations[lo]) * (pos - lo)
+        percentiles = {}
+        for i, row in zip(present, values):
+            percentiles[self.names[i]] = list(row)
+        return percentiles
+
+    def top(self, n=10):
+        """Return the `n' callables with the largest total duration.
+
+        Returns a list of (name, calls, total_ns, mean_ns) tuples.
+        """
+        np = _numpy()
+        ids, durations = self._returned()
+        counts = np.bincount(ids, minlength=len(self.names))
+        totals = np.bincount(ids, weights=durations, minlength=len(self.names))
+        order = np.argsort(-totals, kind='mergesort')[:n]
+        return [(self.names[i], int(counts[i]), totals[i], totals[i] / counts[i])
+                for i in order if counts[i]]
+
+    def rates(self, interval=1.0):
+        """Return calls per second for every callable and interval.
+
+        Returns the start times of the intervals in nanoseconds, and a
+        matrix with a row for each callable in `names' and a column for
+        each interval.
+        """
+        np = _numpy()
+        ids = np.asarray(self.callable).astype(np.intp)
+        start = np.asarray(self.start_ns).astype(np.int64)
+        width = int(interval * 1e9)
+        if not len(start):
+            return np.zeros(0, np.int64), np.zeros((len(self.names), 0))
+        origin = start.min()
+        buckets = ((start - origin) // width).astype(np.intp)
+        nbuckets = buckets.max() + 1
+        counts = np.bincount(ids * nbuckets + buckets,
+                             minlength=len(self.names) * nbuckets)
+        return (origin + np.arange(nbuckets) * width,
+                counts.reshape(len(self.names), nbuckets) / float(interval))
+
+def _numpy():
+    if numpy is None:
+        raise ImportError('columns analysis requires numpy')
+    return numpy
+
+class remote(object):
+    """Log sink shipping messages to a collector process.
+
+    To send the log to a collector listening on a Unix domain socket,
+    use:
+
+        _logged.log = remote('/tmp/autolog.sock')
+
+    The collector is started separately, and writes the log to a file:
+
+        python autolog.py collect /tmp/autolog.sock trace.log
+
+    Calls to write() only append the message, the time, and the thread
+    to a queue. A daemon thread sends the queued messages to the
+    collector in batches, connecting (and reconnecting) as needed.
+
+    The sink never blocks the caller. If more than `maxsize' messages
+    are queued, because the collector cannot keep up or is not
+    running, further messages are dropped. Batches which cannot be
+    sent are dropped as well, and so are messages written after
+    close(). The `sent' and `dropped' attributes count the messages.
+    Call close() before exiting to send any queued messages.
+
+    Known limitations.
+
+    Only the writing of the log is moved to the collector. The
+    representations of arguments and return values are still computed
+    by the decorator, because the objects only exist in the logging
+    process.
+    """
+    def __init__(self, address, maxsize=65536, batchsize=1024, interval=0.01):
+        self.address = address
+        self.maxsize = maxsize
+        self.batchsize = batchsize
+        self.interval = interval
+        self.sent = self.dropped = 0
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._socket = None
+        self._busy = self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def write(self, text):
+        self.writerecord(text, '-')
+
+    def writerecord(self, text, name, t=None, ident=None):
+        """Queue a log message of the callable `name'."""
+        if self._closed or len(self._queue) >= self.maxsize:
+            self._drop(1)
+        else:
+            self._queue.append((t or time.time(),
+                                ident is None and thread.get_ident() or ident,
+                                name, text))
+
+    def flush(self):
+        """Wait until all queued messages have been sent or dropped."""
+        while self._queue or self._busy:
+            time.sleep(self.interval)
+
+    def close(self):
+        """Send all queued messages and stop the background thread."""
+        self._closed = True
+        self._thread.join()
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        # Messages queued while the thread was exiting.
+        self._drop(len(self._queue))
+        self._queue.clear()
+
+    def _drop(self, count):
+        # Callers and the background thread drop messages concurrently.
+        self._lock.acquire()
+        try:
+            self.dropped += count
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        queue = self._queue
+        while True:
+            self._busy = True
+            batch = []
+            try:
+                while len(batch) < self.batchsize:
+                    batch.append(queue.popleft())
+            except IndexError:
+                pass
+            if batch:
+                if self._send(_pack(batch)):
+                    self.sent += len(batch)
+                else:
+                    self._drop(len(batch))
+            self._busy = False
+            if not queue:
+                if self._closed:
+                    return
+                time.sleep(self.interval)
+
+    def _send(self, data):
+        try:
+            if self._socket is None:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    sock.connect(self.address)
+                except socket.error:
+                    sock.close()
+                    raise
+                self._socket = sock
+            self._socket.sendall(data)
+            return True
+        except socket.error:
+            if self._socket is not None:
+                self._socket.close()
+                self._socket = None
+            return False
+
+# Batches are framed by their length and the process identifier, and
+# consist of records giving time, thread, and the callable name and
+# log message, each prefixed by its length.
+_frame = struct.Struct('!II')
+_entry = struct.Struct('!dqHI')
+
+def _pack(batch):
+    """Encode a batch of (time, thread, name, message) tuples."""
+    data = []
+    for t, ident, name, text in batch:
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        data.append(_entry.pack(t, ident, len(name), len(text)))
+        data.append(name)
+        data.append(text)
+    data = ''.join(data)
+    return _frame.pack(len(data), os.getpid()) + data
+
+def _unpack(data):
+    """Decode a batch into a list of (time, thread, name, message)."""
+    records, offset = [], 0
+    while offset < len(data):
+        t, ident, namelen, textlen = _entry.unpack_from(data, offset)
+        offset += _entry.size
+        name = data[offset:offset + namelen]
+        offset += namelen
+        records.append((t, ident, name, data[offset:offset + textlen]))
+        offset += textlen
+    return records
+
+def _unlinkstale(address):
+    """Remove the socket of a collector which is no longer running.
+
+    Raise socket.error if the path exists and is not a socket, or if
+    another collector is listening on it.
+    """
+    try:
+        mode = os.stat(address).st_mode
+    except OSError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise socket.error(errno.EADDRINUSE, 'not a socket: %s' % address)
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            s.connect(address)
+        except socket.error, e:
+            if e.args[0] != errno.ECONNREFUSED:
+                raise
+        else:
+            raise socket.error(errno.EADDRINUSE,
+                               'collector already running: %s' % address)
+    finally:
+        s.close()
+    os.remove(address)
+
+class collector(object):
+    """Collector for log messages shipped by remote sinks.
+
+    The collector listens on a Unix domain socket, and writes all
+    messages it receives to its log, which may be a file or any of the
+    log sinks in this module:
+
+        collector('/tmp/autolog.sock', indexed('trace.log')).serve_forever()
+
+    If the log has a writerecord method, the messages are passed to it
+    with the name of the logged callable, and the time and thread of
+    the call. If
+    `verbose' is true, messages are prefixed by time, process, and
+    thread.
+
+    The same collector is available from the command line:
+
+        python autolog.py collect /tmp/autolog.sock trace.log
+
+    A socket left behind by a collector which exited is replaced. If
+    the address is in use by a running collector, or is not a socket,
+    socket.error is raised.
+
+    Known limitations.
+
+    Each connection is served by its own thread. Messages from
+    different processes are interleaved batch by batch, so times in
+    the log are only roughly ordered. Thread identifiers are only
+    unique within a process.
+    """
+    def __init__(self, address, log, verbose=False):
+        self.address = address
+        self.log = log
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self._running = False
+        _unlinkstale(address)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(address)
+        self._socket.listen(16)
+        self._socket.settimeout(0.1)
+
+    def serve_forever(self):
+        """Accept connections until close() is called."""
+        self._running = True
+        while self._running:
+            try:
+                conn, address = self._socket.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                if self._running:
+                    raise
+                break
+            conn.settimeout(None)
+            worker = threading.Thread(target=self._serve, args=(conn,))
+            worker.setDaemon(True)
+            worker.start()
+
+    def close(self):
+        """Stop serving and remove the socket."""
+        self._running = False
+        self._socket.close()
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+    def _serve(self, conn):
+        try:
+            while True:
+                header = _recv(conn, _frame.size)
+                if header is None:
+                    break
+                length, pid = _frame.unpack(header)
+                data = _recv(conn, length)
+                if data is None:
+                    break
+                self._write(pid, _unpack(data))
+        finally:
+            conn.close()
+
+    def _write(self, pid, records):
+        writerecord = getattr(self.log, 'writerecord', None)
+        self._lock.acquire()
+        try:
+            for t, ident, name, text in records:
+                if self.verbose:
+                    text = '%.6f %d %d %s' % (t, pid, ident, text)
+                if writerecord is None:
+                    self.log.write(text)
+                else:
+                    writerecord(text, name, t, ident)
+            self.log.flush()
+        finally:
+            self._lock.release()
+
+def _recv(conn, size):
+    """Receive exactly `size' bytes, or None at end of stream."""
+    data = []
+    while size:
+        try:
+            chunk = conn.recv(size)
+        except socket.error:
+            return None
+        if not chunk:
+            return None
+        data.append(chunk)
+        size -= len(chunk)
+    return ''.join(data)
+
+def _collect(args):
+    """Command-line interface to the collector."""
+    import optparse
+    parser = optparse.OptionParser(
+        usage='%prog collect [options] SOCKET [FILE]',
+        description='Collect log messages shipped by remote sinks.')
+    parser.add_option('-i', '--indexed', action='store_true',
+                      help='write an indexed trace')
+    parser.add_option('-z', '--compress', action='store_true',
+                      help='write a compressed, rotated file')
+    parser.add_option('-v', '--verbose', action='store_true',
+                      help='prefix messages with time, process and thread')
+    options, args = parser.parse_args(args)
+    if len(args) not in (1, 2):
+        parser.error('expected a socket and an optional file')
+    if (options.indexed or options.compress) and len(args) != 2:
+        parser.error('--indexed and --compress require a file')
+    if options.indexed and (options.compress or options.verbose):
+        parser.error('--indexed excludes --compress and --verbose')
+
+    if options.indexed:
+        log = indexed(args[1])
+    elif options.compress:
+        log = rotating(args[1])
+    elif len(args) == 2:
+        log = open(args[1], 'ab')
+    else:
+        log = sys.stdout
+
+    server = collector(args[0], log, options.verbose)
+    try:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    finally:
+        server.close()
+        if log is not sys.stdout:
+            log.close()
+    return 0
+
 def testsuite():
     class Torinese(object):
         """Example of an autologged class."""
@@ -451,9 +2071,11 @@ def testsuite():
         def testBuiltinDict(self):
             """Testing built-in dict"""
             _dict, __builtins__.dict = __builtins__.dict, logged(__builtins__.dict)
-            self.assertEqual(dict(), {})
-            self.assertInLog('dict')
-            __builtins__.dict = _dict
+            try:
+                self.assertEqual(dict(), {})
+                self.assertInLog('dict')
+            finally:
+                __builtins__.dict = _dict
 
         def testBuiltinDivmod(self):
             """Testing built-in divmod"""
@@ -482,6 +2104,35 @@ def testsuite():
             [exit] say() = \"Funda nen, ma va neanch'avan.\"
             """)
 
+        def testException(self):
+            """Testing function raising an exception"""
+            @logged
+            def say(n):
+                raise ValueError(n)
+
+            class Broken(Exception):
+                def __str__(self):
+                    raise RuntimeError
+                def __repr__(self):
+                    raise RuntimeError
+
+            @logged
+            def fail():
+                raise Broken()
+
+            # Formatting the message must not replace the exception.
+            self.assertRaises(ValueError, say, 1)
+            self.assertRaises(ValueError, say, u'caf\xe9')
+            self.assertRaises(Broken, fail)
+            self.assertLog("""
+            [call] say(1)
+            [raise] say(1) ValueError: 1
+            [call] say(u'caf\\xe9')
+            [raise] say(u'caf\\xe9') ValueError(u'caf\\xe9',)
+            [call] fail()
+            [raise] fail() Broken
+            """)
+
         def testGenerator(self):
             """Testing generator"""
             @logged
@@ -498,6 +2149,73 @@ def testsuite():
             [exit] squares(3) = <generator object squares at 0xb7d7282c>
             """)
 
+        def testCoroutine(self):
+            """Testing coroutine"""
+            @logged
+            def squares(n):
+                for i in range(n):
+                    yield i * i
+
+            @logged
+            def average():
+                total, count = 0.0, 0
+                while True:
+                    total += yield (count and total / count)
+                    count += 1
+
+            @logged
+            def failing():
+                yield 1
+                raise ValueError(u'caf\xe9')
+
+            _logged.coroutines = True
+            try:
+                self.assertEqual(list(squares(3)), [0, 1, 4])
+                coroutine = average()
+                coroutine.next()
+                self.assertEqual(coroutine.send(2), 2)
+                self.assertEqual(coroutine.send(4), 3)
+                coroutine.close()
+                coroutine.close()
+                coroutine = average()
+                coroutine.next()
+                self.assertRaises(TypeError, coroutine.send, 'x')
+                self.assertRaises(StopIteration, coroutine.next)
+                coroutine = failing()
+                coroutine.next()
+                self.assertRaises(ValueError, coroutine.next)
+            finally:
+                _logged.coroutines = False
+            _logged.log = StringIO.StringIO(
+                re.sub('after [0-9.]+s', 'after 0s', _logged.log.getvalue()))
+            self.assertLog("""\
+            [start] squares(3)
+            [finish] squares(3) after 0s
+            [start] average()
+            [cancel] average() after 0s
+            [start] average()
+            [fail] average() TypeError: unsupported operand type(s) for +=: 'float' and 'str' after 0s
+            [start] failing()
+            [fail] failing() ValueError(u'caf\\xe9',) after 0s
+            """)
+
+        def testQueued(self):
+            """Testing queued log sink"""
+            @logged
+            def say(n):
+                return n
+
+            log, _logged.log = _logged.log, queued(_logged.log)
+            try:
+                say(1)
+                _logged.log.close()
+            finally:
+                _logged.log = log
+            self.assertLog("""\
+            [call] say(1)
+            [exit] say(1) = 1
+            """)
+
         def testLambdaExpression(self):
             """Testing lambda expression"""
             identity = logged(lambda x: x)
@@ -850,11 +2568,452 @@ def testsuite():
             [exit] <__main__.Foo object at 0xb7d4c38c>.__init__() = None
             """)
 
+        def testCollapsed(self):
+            """Testing collapsed log sink"""
+            @logged
+            def poll(n):
+                return None
+
+            log, _logged.log = _logged.log, collapsed(_logged.log)
+            try:
+                for i in range(5):
+                    poll(1)
+                poll(2)
+                _logged.log.close()
+
+                # A call which does not return is written out by the timer.
+                sink = collapsed(log, interval=0.01)
+                sink.write('[call] hang()\n')
+                for i in range(100):
+                    if log.getvalue().endswith('[call] hang()\n'):
+                        break
+                    time.sleep(0.01)
+                sink.close()
+            finally:
+                _logged.log = log
+            self.assertLog("""\
+            [call] poll(1)
+            [exit] poll(1) = None
+            ... repeated 4 times
+            [call] poll(2)
+            [exit] poll(2) = None
+            [call] hang()
+            """)
+
+        def testCollapsedRecords(self):
+            """Testing time and thread of collapsed records"""
+            class Recorder(object):
+                def __init__(self):
+                    self.records = []
+                def write(self, text):
+                    self.writerecord(text, '-')
+                def writerecord(self, text, name, t=None, ident=None):
+                    self.records.append((text, name, t, ident))
+                def flush(self):
+                    pass
+
+            sink = collapsed(Recorder(), interval=60)
+            for i in range(3):
+                sink.writerecord('[call] f()\n', 'f', 1.0 + i, 7)
+                sink.writerecord('[exit] f() = None\n', 'f', 1.5 + i, 7)
+            sink.writerecord('[call] g()\n', 'g', 4.0, 8)
+            worker = threading.Thread(target=sink.write, args=('[call] h()\n',))
+            worker.start()
+            worker.join()
+            sink.close()
+            records = sorted(sink.stream.records, key=lambda record: record[2])
+            self.assertEqual(records[:-1], [
+                ('[call] f()\n', 'f', 1.0, 7),
+                ('[exit] f() = None\n', 'f', 1.5, 7),
+                ('... repeated 2 times\n', 'f', 3.5, 7),
+                ('[call] g()\n', 'g', 4.0, 8)])
+            self.assertEqual(records[-1][::3], ('[call] h()\n', worker.ident))
+
+        def testRotating(self):
+            """Testing compressed, rotated log sink"""
+            import gzip, os, shutil, tempfile
+            @logged
+            def say(n):
+                return n
+
+            tmpdir = tempfile.mkdtemp()
+            filename = os.path.join(tmpdir, 'trace.log.gz')
+            log, _logged.log = _logged.log, rotating(filename, maxbytes=1, backups=10)
+            try:
+                for i in range(3):
+                    say(i)
+                    _logged.log.flush()
+                _logged.log.close()
+
+                names = sorted(os.listdir(tmpdir), reverse=True)
+                self.assert_(len(names) >= 3)
+                text = ''.join([gzip.open(os.path.join(tmpdir, name)).read()
+                                for name in names])
+
+                # A restart keeps the previous log.
+                last = gzip.open(filename).read()
+                _logged.log = rotating(filename, backups=10, compression=None)
+                say(3)
+                _logged.log.close()
+                self.assertEqual(len(os.listdir(tmpdir)), len(names) + 1)
+                self.assertEqual(gzip.open(filename + '.1').read(), last)
+                self.assertEqual(open(filename).read(),
+                                 '[call] say(3)\n[exit] say(3) = 3\n')
+            finally:
+                _logged.log = log
+                shutil.rmtree(tmpdir)
+            self.assertEqual(text, ''.join(['[call] say(%d)\n[exit] say(%d) = %d\n'
+                                            % (i, i, i) for i in range(3)]))
+
+        def testRotatingExit(self):
+            """Testing compressed log sink left open at exit"""
+            import gzip, os, shutil, subprocess, tempfile
+            tmpdir = tempfile.mkdtemp()
+            filename = os.path.join(tmpdir, 'trace.log.gz')
+            script = ('import sys; sys.path.insert(0, %r); import autolog\n'
+                      'autolog._logged.log = autolog.rotating(%r)\n'
+                      'autolog.logged(len)("abc")\n'
+                      % (os.path.dirname(os.path.abspath(__file__)), filename))
+            try:
+                subprocess.check_call([sys.executable, '-c', script])
+                text = gzip.open(filename).read()
+            finally:
+                shutil.rmtree(tmpdir)
+            self.assertEqual(text, "[call] len('abc')\n[exit] len('abc') = 3\n")
+
+        def testIndexed(self):
+            """Testing indexed trace"""
+            import os, shutil, tempfile
+            @logged
+            def say(n):
+                return n
+
+            tmpdir = tempfile.mkdtemp()
+            filename = os.path.join(tmpdir, 'trace.log')
+            log, _logged.log = _logged.log, indexed(filename, blocksize=3)
+            try:
+                start = time.time()
+                obj = Torinese('Ludovico')
+                obj.show('Com alle?')
+                _logged.log.close()
+                middle = time.time()
+                _logged.log = indexed(filename, blocksize=3)
+                say(1)
+                obj.show('Ciao.')
+                _logged.log.close()
+
+                records = trace(filename)
+                self.assertEqual(len(records), 8)
+                shows = list(records.query('Torinese.show'))
+                self.assertEqual([line for t, ident, line in shows], [
+                    "[call] Torinese('Ludovico').show('Com alle?')\n",
+                    "[exit] Torinese('Ludovico').show('Com alle?') = None\n",
+                    "[call] Torinese('Ludovico').show('Ciao.')\n",
+                    "[exit] Torinese('Ludovico').show('Ciao.') = None\n"])
+                self.assertEqual(len(list(records.query('Torinese.show', start, middle))), 2)
+                self.assertEqual(len(list(records.query(start=middle))), 4)
+                self.assertEqual(len(list(records.query(ident=thread.get_ident()))), 8)
+                self.assertEqual(list(records.query(ident=0)), [])
+                self.assertEqual(list(records.query('say', end=start)), [])
+                self.assertEqual(list(records.query('missing')), [])
+            finally:
+                _logged.log = log
+                shutil.rmtree(tmpdir)
+
+        def testColumns(self):
+            """Testing columnar export of an indexed trace"""
+            import os, shutil, tempfile
+            @logged
+            def fail():
+                raise ValueError
+            @logged
+            def g():
+                pass
+            @logged
+            def outer():
+                try:
+                    fail()
+                except ValueError:
+                    pass
+                g()
+            @logged
+            def gen():
+                yield 1
+            @logged
+            def consume(iterable):
+                return list(iterable)
+            @logged
+            def main():
+                consume(gen())
+                gen().close()
+                g()
+
+            tmpdir = tempfile.mkdtemp()
+            filename = os.path.join(tmpdir, 'trace.log')
+            log, _logged.log = _logged.log, indexed(filename)
+            try:
+                obj = Torinese('Ludovico')
+                obj.talk()
+                obj.talk()
+                _logged.log.close()
+
+                calls = columns(trace(filename))
+                self.assertEqual(calls.names, ['Torinese.__init__', 'Torinese.talk',
+                                               'Torinese.show'])
+                self.assertEqual(list(calls.callable), [0, 1, 2, 1, 2])
+                self.assertEqual(list(calls.depth), [0, 0, 1, 0, 1])
+                self.assert_(min(calls.duration_ns) >= 0)
+                self.assert_(calls.duration_ns[1] >= calls.duration_ns[2])
+
+                if numpy is not None:
+                    calls.save(os.path.join(tmpdir, 'trace.npz'))
+                    calls = columns.load(os.path.join(tmpdir, 'trace.npz'))
+                    self.assertEqual(len(calls), 5)
+                    self.assertEqual(calls.top(1)[0][:2], ('Torinese.talk', 2))
+                    percentiles = calls.percentiles((0, 100))
+                    self.assertEqual(percentiles['Torinese.talk'],
+                                     sorted(calls.duration_ns[[1, 3]]))
+                    starts, rates = calls.rates(3600)
+                    self.assertEqual((rates.sum(axis=1) * 3600).round().tolist(), [1, 2, 2])
+
+                # Calls which raised are paired with their [raise] message.
+                filename = os.path.join(tmpdir, 'raise.log')
+                _logged.log = indexed(filename)
+                _logged.log.writerecord('[exit] stray() = None\n', 'stray')
+                outer()
+                _logged.log.close()
+
+                calls = columns(trace(filename))
+                self.assertEqual(calls.names, ['outer', 'fail', 'g'])
+                self.assertEqual(list(calls.depth), [0, 1, 1])
+                self.assert_(min(calls.duration_ns) >= 0)
+
+                # Coroutines do not enclose the calls which follow them.
+                filename = os.path.join(tmpdir, 'coroutine.log')
+                _logged.log = indexed(filename)
+                _logged.coroutines = True
+                try:
+                    main()
+                finally:
+                    _logged.coroutines = False
+                _logged.log.close()
+
+                calls = columns(trace(filename))
+                self.assertEqual(calls.names, ['main', 'gen', 'consume', 'g'])
+                self.assertEqual(list(calls.callable), [0, 1, 2, 1, 3])
+                self.assertEqual(list(calls.depth), [0, 1, 1, 1, 1])
+                self.assert_(min(calls.duration_ns) >= 0)
+            finally:
+                _logged.log = log
+                shutil.rmtree(tmpdir)
+
+        def testGovernor(self):
+            """Testing overhead governor"""
+            class Slow(object):
+                def __init__(self, log):
+                    self.log = log
+                def write(self, text):
+                    time.sleep(0.001)
+                    self.log.write(text)
+
+            @logged
+            def poll(n):
+                return n
+
+            def other():
+                @logged
+                def poll(n):
+                    raise ValueError(n)
+                return poll
+
+            log, _logged.log = _logged.log, Slow(_logged.log)
+            _logged.governor = budget = governor(percall=0, interval=0, rate=2)
+            try:
+                for i in range(5):
+                    poll(i)
+                self.assertRaises(ValueError, other(), 5)
+            finally:
+                _logged.log, _logged.governor = log, None
+            stats, failing = budget.stats()
+            self.assertEqual(stats['name'], 'poll')
+            self.assertEqual(stats['level'], governor.COUNTED)
+            self.assertEqual((stats['calls'], stats['logged']), (5, 2))
+            self.assert_(stats['overhead'] >= 0.004)
+            self.assertEqual(failing['name'], 'poll')
+            self.assertEqual((failing['calls'], failing['logged']), (1, 1))
+            self.assertLog("""\
+            [call] poll(0)
+            [exit] poll(0) = 0
+            [call] poll(2)
+            [exit] poll(2) = 2
+            [call] poll(5)
+            [raise] poll(5) ValueError: 5
+            """)
+
+        def testTraced(self):
+            """Testing targeted tracing"""
+            @logged
+            def say(n):
+                return n
+
+            def spawn(target, *args):
+                worker = threading.Thread(target=target, args=args)
+                worker.start()
+                worker.join()
+
+            def enter(context, entered, leave, scopes):
+                context.__enter__()
+                entered.set()
+                leave.wait()
+                context.__exit__(None, None, None)
+                scopes.append(traced.current())
+
+            _logged.targeted = True
+            try:
+                say(1)
+                outer = traced('request-2')
+                outer.__enter__()
+                try:
+                    self.assertEqual(traced.current(), 'request-2')
+                    say(2)
+                    spawn(traced.propagate(say), 3)
+                    spawn(say, 4)
+                    inner = traced(None)
+                    inner.__enter__()
+                    try:
+                        say(5)
+                    finally:
+                        inner.__exit__(None, None, None)
+                finally:
+                    outer.__exit__(None, None, None)
+                say(6)
+            finally:
+                _logged.targeted = False
+            self.assertEqual(traced.current(), None)
+
+            # The same scope entered by two threads.
+            shared, scopes = traced('shared'), []
+            entered, leave = threading.Event(), threading.Event()
+            worker = threading.Thread(
+                target=traced.propagate(enter),
+                args=(shared, entered, leave, scopes))
+            outer = traced('request-7')
+            outer.__enter__()
+            try:
+                shared.__enter__()
+                worker.start()
+                entered.wait()
+                shared.__exit__(None, None, None)
+                self.assertEqual(traced.current(), 'request-7')
+            finally:
+                outer.__exit__(None, None, None)
+            leave.set()
+            worker.join()
+            self.assertEqual(scopes, [None])
+            self.assertLog("""\
+            [call] say(2)
+            [exit] say(2) = 2
+            [call] say(3)
+            [exit] say(3) = 3
+            """)
+
+        def testTracedMethod(self):
+            """Testing targeted tracing of methods"""
+            class Counted(object):
+                __metaclass__ = autolog
+                reprs = 0
+                def __repr__(self):
+                    Counted.reprs += 1
+                    return 'Counted()'
+                def show(self, n):
+                    return n
+
+            obj = Counted()
+            _logged.targeted = True
+            try:
+                # Outside a scope, methods are only bound.
+                for i in range(3):
+                    self.assertEqual(obj.show(i), i)
+                method = obj.show
+                self.assertEqual(Counted.reprs, 0)
+
+                scope = traced('request-8')
+                scope.__enter__()
+                try:
+                    obj.show(3)
+                    method(4) # retrieved outside the scope
+                finally:
+                    scope.__exit__(None, None, None)
+                self.assertEqual(Counted.reprs, 1)
+            finally:
+                _logged.targeted = False
+            self.assertLog("""\
+            [call] Counted().show(3)
+            [exit] Counted().show(3) = 3
+            """)
+
+        def testRemote(self):
+            """Testing remote sink and collector"""
+            import os, shutil, tempfile
+            @logged
+            def say(n):
+                return n
+
+            tmpdir = tempfile.mkdtemp()
+            address = os.path.join(tmpdir, 'autolog.sock')
+            stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            stale.bind(address)
+            stale.close()
+            server = collector(address, _logged.log)
+            worker = threading.Thread(target=server.serve_forever)
+            worker.start()
+            log, _logged.log = _logged.log, remote(address)
+            try:
+                self.assertRaises(socket.error, collector, address, log)
+                say(1)
+                say(2)
+                sink = _logged.log
+                sink.close()
+                for i in range(100):
+                    if log.getvalue().count('\n') == 4:
+                        break
+                    time.sleep(0.01)
+            finally:
+                _logged.log = log
+                server.close()
+                worker.join()
+
+            # Messages are dropped if no collector is listening.
+            lost = remote(address)
+            lost.write('[call] say(3)\n')
+            lost.close()
+            lost.write('[exit] say(3) = 3\n')
+            open(address, 'w').close()
+            try:
+                self.assertRaises(socket.error, collector, address, log)
+                self.assertTrue(os.path.exists(address))
+            finally:
+                shutil.rmtree(tmpdir)
+
+            self.assertEqual((sink.sent, sink.dropped), (4, 0))
+            self.assertEqual((lost.sent, lost.dropped), (0, 2))
+            self.assertLog("""\
+            [call] say(1)
+            [exit] say(1) = 1
+            [call] say(2)
+            [exit] say(2) = 2
+            """)
+
     return unittest.TestLoader().loadTestsFromTestCase(AutologTestCase)
 
 if __name__ == '__main__':
     import unittest, sys, StringIO
 
+    if sys.argv[1:2] == ['query']:
+        sys.exit(_query(sys.argv[2:]))
+    if sys.argv[1:2] == ['collect']:
+        sys.exit(_collect(sys.argv[2:]))
+
     _stdout, sys.stdout = sys.stdout, StringIO.StringIO()
 
     unittest.TextTestRunner(verbosity=2).run(testsuite())